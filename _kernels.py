@@ -0,0 +1,151 @@
+"""Numeric kernels of dataPlot.
+
+The kernels are compiled with numba when it is installed. They can also be compiled ahead of time
+into the dataplot_kernels extension module, so that no compilation happens at import:
+
+    python _kernels.py
+
+"""
+import os
+import numpy as np
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+try:
+    import dataplot_kernels
+except ImportError:
+    dataplot_kernels = None
+
+def _lttb_indices_numpy(x, y, n_out):
+    """Indices of the points kept by the Largest-Triangle-Three-Buckets algorithm, vectorized per bucket."""
+    n = len(x)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    # The points between the first and the last points are split into n_out-2 buckets
+    bucket = (n - 2) / (n_out - 2)
+    a = 0
+    for i in range(n_out - 2):
+        start = int(i * bucket) + 1
+        end = int((i + 1) * bucket) + 1
+        next_end = max(min(int((i + 2) * bucket) + 1, n), end + 1)
+        # Keep the point of the bucket forming the largest triangle with the previously kept point
+        # and the average of the next bucket
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        idx[i + 1] = a
+    return idx
+
+def _lttb_indices_loops(x, y, n_out):
+    """Same as _lttb_indices_numpy, written as plain loops so that numba can compile it."""
+    n = len(x)
+    idx = np.empty(n_out, dtype=np.int64)
+    idx[0], idx[-1] = 0, n - 1
+    bucket = (n - 2) / (n_out - 2)
+    a = 0
+    for i in range(n_out - 2):
+        start = int(i * bucket) + 1
+        end = int((i + 1) * bucket) + 1
+        next_end = max(min(int((i + 2) * bucket) + 1, n), end + 1)
+        avg_x = 0.0
+        avg_y = 0.0
+        for j in range(end, next_end):
+            avg_x += x[j]
+            avg_y += y[j]
+        avg_x /= next_end - end
+        avg_y /= next_end - end
+        ax, ay = x[a], y[a]
+        max_area = -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (y[j] - ay) - (ax - x[j]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                a = j
+        idx[i + 1] = a
+    return idx
+
+if njit is not None:
+    # fastmath is not used, since it makes comparisons with NaN undefined
+    _lttb_indices_jit = njit(cache=True)(_lttb_indices_loops)
+else:
+    _lttb_indices_jit = _lttb_indices_numpy
+
+def _lttb_run_indices(x, y, n_out):
+    """Indices kept by the fastest available kernel, for a line without NaN."""
+    if dataplot_kernels is not None and x.dtype == y.dtype and x.flags.writeable and y.flags.writeable:
+        if x.dtype == np.float64:
+            return dataplot_kernels.lttb_indices_f8(x, y, n_out)
+        if x.dtype == np.float32:
+            return dataplot_kernels.lttb_indices_f4(x, y, n_out)
+    return _lttb_indices_jit(x, y, n_out)
+
+def lttb_indices(x, y, n_out, kernel=None):
+    """Indices of the points kept by the Largest-Triangle-Three-Buckets algorithm.
+
+    The ahead-of-time compiled kernel is used when it is built and the arrays match its signature,
+    otherwise the numba kernel, or the numpy version if numba is not installed.
+    Points where x or y is NaN split the line into runs, which are downsampled separately in
+    proportion to their length. The first NaN point after each run is kept, so that the gap is still drawn.
+
+    Parameters
+    ----------
+    x : 1D array
+        The x data of the line.
+    y : 1D array
+        The y data of the line.
+    n_out : int
+        Number of points to keep, at least 3 and less than the number of points.
+    kernel : callable, default=None
+        The kernel to use for the runs, with the signature of _lttb_indices_numpy.
+        The fastest available kernel is used if None.
+
+    Returns
+    -------
+    idx : 1D array of int64
+        The indices of the kept points.
+
+    """
+    if kernel is None:
+        kernel = _lttb_run_indices
+    finite = np.isfinite(x) & np.isfinite(y)
+    if finite.all():
+        return kernel(x, y, n_out)
+    # Starts and stops of the runs of finite points
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], finite.view(np.int8), [0]))))
+    starts, stops = edges[::2], edges[1::2]
+    n_finite = stops.sum() - starts.sum()
+    parts = []
+    for start, stop in zip(starts, stops):
+        n_run = stop - start
+        n_run_out = int(round(n_out * n_run / n_finite))
+        if n_run_out >= n_run:
+            parts.append(np.arange(start, stop))
+        elif n_run_out < 3:
+            parts.append(np.unique([start, stop - 1]))
+        else:
+            parts.append(start + kernel(x[start:stop], y[start:stop], n_run_out))
+        if stop < starts[-1]:
+            parts.append(np.array([stop]))
+    if not parts:
+        return np.arange(0, dtype=np.int64)
+    return np.concatenate(parts).astype(np.int64)
+
+if __name__ == '__main__':
+    import importlib
+    from numba.pycc import CC
+    cc = CC('dataplot_kernels')
+    cc.output_dir = os.path.dirname(os.path.abspath(__file__))
+    cc.export('lttb_indices_f8', 'i8[:](f8[:], f8[:], i8)')(_lttb_indices_loops)
+    cc.export('lttb_indices_f4', 'i8[:](f4[:], f4[:], i8)')(_lttb_indices_loops)
+    cc.compile()
+    # Check that the compiled kernels select the same points as the numpy version, including with NaN gaps
+    dataplot_kernels = importlib.import_module('dataplot_kernels')
+    x = np.linspace(0, 100, 50000)
+    y = np.sin(x) + np.random.default_rng(0).random(len(x))
+    y[20000:25000] = np.nan
+    for dtype in (np.float64, np.float32):
+        x_check, y_check = x.astype(dtype), y.astype(dtype)
+        expected = lttb_indices(x_check, y_check, 1000, kernel=_lttb_indices_numpy)
+        for kernel in (_lttb_indices_jit, _lttb_run_indices):
+            assert np.array_equal(lttb_indices(x_check, y_check, 1000, kernel=kernel), expected)
@@ -1,6 +1,180 @@
+import csv
+import os
+import threading
+import zipfile
+from dataclasses import dataclass, field, fields
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.ticker import PercentFormatter
+from matplotlib.lines import Line2D
+from matplotlib.collections import LineCollection
+from _kernels import lttb_indices
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+def _cache_path(path, col):
+    """Path of the .npz cache of a column of a csv file."""
+    return path + '.' + quote(col, safe='') + '.npz'
+
+def _cached_col(path, col, csv_stat):
+    """Read the .npz cache of a column of a csv file, or return None if it is missing, stale or unreadable.
+
+    The cache stores the size and modification time of the csv file it was made from,
+    and is only used if they match the current csv file.
+    """
+    try:
+        with np.load(_cache_path(path, col)) as cache:
+            if cache['csv_size'] != csv_stat.st_size or cache['csv_mtime_ns'] != csv_stat.st_mtime_ns:
+                return None
+            return cache['data']
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+        return None
+
+def _save_cached_col(path, col, array, csv_stat):
+    """Save the .npz cache of a column of a csv file; the cache is skipped if it cannot be written."""
+    cache_path = _cache_path(path, col)
+    tmp_path = f'{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        # The cache is written to a temporary file first, so that an interrupted or concurrent
+        # write never leaves a truncated cache
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, data=array, csv_size=csv_stat.st_size, csv_mtime_ns=csv_stat.st_mtime_ns)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+def _load(path, columns):
+    """Read columns of a csv file, using caches of the columns next to it.
+
+    Columns without an up-to-date cache are read with _read_columns and saved to their cache.
+
+    Parameters
+    ----------
+    path : str
+        Path of the csv file.
+    columns : list
+        Names of the columns to read, parsed as float64.
+
+    Returns
+    -------
+    data : dict
+        {'column name': 1D array, ...}
+
+    """
+    csv_stat = os.stat(path)
+    data = {}
+    missing = []
+    for col in columns:
+        array = _cached_col(path, col, csv_stat)
+        if array is None:
+            missing.append(col)
+        else:
+            data[col] = array
+    if missing:
+        for col, array in _read_columns(path, missing).items():
+            data[col] = array
+            _save_cached_col(path, col, array, csv_stat)
+    return data
+
+def _read_columns(path, columns):
+    """Read columns of a csv file as float64 arrays.
+
+    Numeric files are parsed with np.loadtxt without building a DataFrame; files it cannot parse
+    (non-numeric or missing values) are read with pandas, using the pyarrow engine when it is available.
+    """
+    # utf-8-sig drops the byte order mark of files exported by Excel, as pandas does
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        header = next(csv.reader(f))
+    header_map = {name: i for i, name in enumerate(header)}
+    try:
+        array = np.loadtxt(path, delimiter=',', skiprows=1, usecols=[header_map[col] for col in columns],
+                           dtype=np.float64, ndmin=2, quotechar='"', comments=None, encoding='utf-8-sig')
+        return {col: array[:, i] for i, col in enumerate(columns)}
+    except ValueError:
+        df = pd.read_csv(path, usecols=columns, dtype={col: np.float64 for col in columns},
+                         engine='c' if pyarrow is None else 'pyarrow')
+        return {col: df[col].to_numpy() for col in columns}
+
+def _lttb(x, y, n_out):
+    """Downsample a line with the Largest-Triangle-Three-Buckets algorithm.
+
+    Parameters
+    ----------
+    x : 1D array
+        The x data of the line.
+    y : 1D array
+        The y data of the line.
+    n_out : int
+        Number of points to keep, including the first and the last points.
+
+    Returns
+    -------
+    x, y : 1D arrays
+        The downsampled data.
+
+    """
+    if n_out >= len(x) or n_out < 3:
+        return x, y
+    idx = lttb_indices(x, y, n_out)
+    return x[idx], y[idx]
+
+@dataclass(frozen=True, slots=True)
+class LineSpec:
+    """The configuration of a line, see line_cfg in plot_line2D."""
+    xdata_array: object
+    ydata_array: object
+    xdata: tuple | None = None
+    ydata: tuple | None = None
+    rightYAxis: str | bool = False
+    ylim_right: tuple | list | bool = False
+    rightYAxis_percentage: bool = False
+    color: str = 'b'
+    linestyle: str = '-'
+    marker: str | None = None
+    markevery: int = 1
+    label: str | None = None
+    line_kwargs: dict = field(default_factory=dict)
+    downsample: bool = True
+
+def _downsample(x, y, n_out, xlim=None):
+    """Downsample a line to n_out points over the visible x range.
+
+    If xlim is given and x is sorted, the line is first cut to the points inside xlim, plus one point
+    on each side, so that the whole point budget is spent on the visible part of the line.
+    If x is not sorted, a line with xlim is not downsampled, since cutting it could join distant points.
+
+    Parameters
+    ----------
+    x : 1D array
+        The x data of the line.
+    y : 1D array
+        The y data of the line.
+    n_out : int
+        Number of points to keep.
+    xlim : tuple, default=None
+        The lower and upper limits of the x-axis.
+
+    Returns
+    -------
+    x, y : 1D arrays
+        The downsampled data.
+
+    """
+    if xlim is not None:
+        if not np.all(np.diff(x) >= 0):
+            return x, y
+        start = max(np.searchsorted(x, min(xlim), side='left') - 1, 0)
+        stop = np.searchsorted(x, max(xlim), side='right') + 1
+        x, y = x[start:stop], y[start:stop]
+    return _lttb(x, y, n_out)
 
 def subplots_ajdust(fig_cfg, **subtitle_kwargs):
     """Create a figure and a set of subplots with the specified configuration.
@@ -36,6 +210,10 @@ def subplots_ajdust(fig_cfg, **subtitle_kwargs):
             The amount of width reserved for space between subplots, expressed as a fraction of the average axis width.
         - hspace: float, default=0.2
             The amount of height reserved for space between subplots, expressed as a fraction of the average axis height.
+        - sharex: bool, default=False
+            If True, the subplots share the x-axis, so its ticks and limits are computed once.
+        - sharey: bool, default=False
+            If True, the subplots share the y-axis.
         - legend_kwargs: dict
             https://matplotlib.org/stable/api/_as_gen/matplotlib.figure.Figure.legend.html
         - subtitle_kwargs : dict
@@ -58,21 +236,30 @@ def subplots_ajdust(fig_cfg, **subtitle_kwargs):
     hspace = fig_cfg.get('hspace', 0.2)    
     rows, cols = fig_cfg.get('num_rows', 1), fig_cfg.get('num_cols', 1)
     width, height = fig_cfg.get('width', 6), fig_cfg.get('height', 9) 
-    plt.rcParams['figure.dpi'] = 300
-    plt.rcParams['font.size'] = fig_cfg.get('fontsize', 10)
-    fig, axs = plt.subplots(rows,cols,figsize=(width, height),squeeze=False)
+    # rcParams are only written when they change, to keep the cached font properties of matplotlib
+    style = {'figure.dpi': 300, 'font.size': fig_cfg.get('fontsize', 10)}
+    if any(plt.rcParams[key] != value for key, value in style.items()):
+        plt.rcParams.update(style)
+    fig, axs = plt.subplots(rows,cols,figsize=(width, height),squeeze=False,
+                            sharex=fig_cfg.get('sharex', False), sharey=fig_cfg.get('sharey', False))
     fig.suptitle(fig_cfg.get('fig_title', ''), y=fig_cfg.get('title_y', 0.98),  **fig_cfg.get('subtitle_kwargs', {}))
     fig.subplots_adjust(left=left, bottom=bottom, right=right, top=top, wspace=wspace, hspace=hspace)
 
     return fig, axs
 
-def plot_line2D(fig_cfg, plot_cfg, line_cfg):
+def plot_line2D(fig_cfg, plot_cfg, line_cfg, show=False):
     """Plot the data on the specified axes as lines.
 
     Parameters
     ----------
-    axs : an array of Axes objects
-        The array of axes objects.
+    fig_cfg : dict
+        A dictionary containing the configuration of the figure and subplots, see subplots_ajdust.
+        The dictionary may also contain the following keys:
+        - animated: bool, default=False
+            If True, the lines are animated artists that can be updated with update_line2D,
+            which redraws only the lines over the saved background of the axes (blitting).
+        If sharex is not given, the plots are in a single row and they all have the same xlim, xscale,
+        xticks, xticks_kwargs and xticks_percentage, the x-axis is shared.
     plot_cfg : dict
         A dictionary containing the configuration of the plots
         {'plot_id': dict, ...}
@@ -138,6 +325,8 @@ def plot_line2D(fig_cfg, plot_cfg, line_cfg):
             Tuple containing the file name and the column name of the y-axis data.
         - rightYAxis: str, default=False
             Label of the right y-axis.
+            The right y-axis is shared by the lines of a plot, and its label, limits and format
+            are taken from the first of these lines.
         - ylim_right: tuple, default=False
             Tuple containing the lower and upper limits of the right y-axis.
         _ rightYAxis_percentage: bool, default=False
@@ -156,6 +345,11 @@ def plot_line2D(fig_cfg, plot_cfg, line_cfg):
         - line_kwargs: dict, default={}
             Additional properties for the line.
             https://matplotlib.org/stable/api/_as_gen/matplotlib.lines.Line2D.html
+            Lines without marker and line_kwargs are drawn together as one LineCollection per axes.
+        - downsample: bool, default=True
+            If True, lines without markers that have more than 4 points per pixel of the figure width
+            are downsampled to that density with the Largest-Triangle-Three-Buckets algorithm.
+            When xlim is set, only the part of the line inside xlim is plotted and downsampled.
 
     save_fig : dict
         A dictionary containing the configuration of saving the figure.
@@ -167,62 +361,76 @@ def plot_line2D(fig_cfg, plot_cfg, line_cfg):
         - filename: str, default='new_fig'
             Name of the saved figure.
 
+    show : bool, default=False
+        If True, the figure is shown with plt.show().
+        Otherwise the figure is closed once it is saved, unless fig_cfg['animated'] is True.
+
+    Returns
+    -------
+    fig : matplotlib.figure.Figure
+        The figure object.
+    line_handles : dict
+        The plotted lines
+        {'line_id': matplotlib.lines.Line2D or (matplotlib.collections.LineCollection, index), ...}
+        Lines without marker and line_kwargs are batched in one LineCollection per axes,
+        and are given as the collection and the index of their segment in it.
+        These lines are not in ax.get_lines(), which only holds their empty legend entries.
+
     """
+    # Shared x-axes also share their ticks and formatter, and hide the tick labels of the upper rows,
+    # so the x-axis is only shared automatically for a single row of plots with the same x settings
+    if 'sharex' not in fig_cfg and len(plot_cfg) > 1 and fig_cfg.get('num_rows', 1) == 1:
+        x_settings = [(list(plot_data['xlim']), plot_data.get('xscale', 'linear'), list(plot_data.get('xticks') or []),
+                       plot_data.get('xticks_kwargs', {}), plot_data.get('xticks_percentage', False))
+                      if 'xlim' in plot_data else None for plot_data in plot_cfg.values()]
+        if x_settings[0] is not None and all(x_setting == x_settings[0] for x_setting in x_settings):
+            fig_cfg = {**fig_cfg, 'sharex': True}
     fig, axs=subplots_ajdust(fig_cfg)
     # Read data from the files first to avoid reading the same file multiple times
     # If the same file is used for multiple lines, read the file once and use the data for all the lines
-    data_files = {}
-    data_file_names = {}
-    nfiles = 0
+    # Only the columns used by the lines are read
+    needed_cols = {}
+    for line_data in line_cfg.values():
+        for key in ('xdata', 'ydata'):
+            if key in line_data:
+                needed_cols.setdefault(line_data[key][0], set()).add(line_data[key][1])
+    # The files are independent, so they are read in parallel
+    frames = {}
+    if needed_cols:
+        paths = list(needed_cols)
+        with ThreadPoolExecutor(max_workers=min(8, len(paths))) as executor:
+            frames = dict(zip(paths, executor.map(lambda path: _load(path, sorted(needed_cols[path])), paths)))
     for line_id, line_data in line_cfg.items():
         if 'xdata' in line_data:
-            if  line_data['xdata'][0] not in data_file_names:
-                # add the file to the data_files dictionary
-                nfiles += 1
-                data_files[nfiles] = pd.read_csv(line_data['xdata'][0])
-                data_file_names[nfiles] = line_data['xdata'][0]
-                line_data['xdata_array'] = data_files[nfiles][line_data['xdata'][1]]
-            else:
-                # find the file in the data_files dictionary and use the data
-                for k, v in data_file_names.items():
-                    if v == line_data['xdata'][0]:
-                        line_data['xdata_array'] = data_files[k][line_data['xdata'][1]]
-                        break
+            path = line_data['xdata'][0]
+            line_data['xdata_array'] = frames[path][line_data['xdata'][1]]
         elif 'xdata_array' in line_data:
             pass
         else:
             raise ValueError('xdata or xdata_array is missing in line_cfg')
             
         if 'ydata' in line_data:
-            if line_data['ydata'][0] not in data_file_names:
-                # add the file to the data_files dictionary
-                nfiles += 1
-                data_file_names[nfiles] = line_data['ydata'][0]
-                data_files[nfiles] = pd.read_csv(line_data['ydata'][0])
-                line_data['ydata_array'] = data_files[nfiles][line_data['ydata'][1]]
-            else:
-                # find the file in the data_files dictionary and use the data
-                for k, v in data_file_names.items():
-                    if v == line_data['ydata'][0]:
-                        line_data['ydata_array'] = data_files[k][line_data['ydata'][1]]
-                        break
+            path = line_data['ydata'][0]
+            line_data['ydata_array'] = frames[path][line_data['ydata'][1]]
         elif 'ydata_array' in line_data:
             pass
         else:
             raise ValueError('ydata or ydata_array is missing in line_cfg')
+    # Keys that are not line settings are ignored, as they were before LineSpec
+    spec_keys = {spec_field.name for spec_field in fields(LineSpec)}
+    specs = {line_id: LineSpec(**{key: value for key, value in line_data.items() if key in spec_keys})
+             for line_id, line_data in line_cfg.items()}
 
+    # Lines denser than 4 points per pixel of the figure width are downsampled before plotting
+    n_max_points = int(4 * fig.get_size_inches()[0] * fig.dpi)
+    line_handles = {}
     for plot_id, plot_data in plot_cfg.items():
         ax = axs.flatten()[plot_id-1]
-        if 'xlabel' in plot_data :
-            ax.set_xlabel(plot_data['xlabel'])
-        if 'ylabel' in plot_data :
-            ax.set_ylabel(plot_data['ylabel'])
-        if 'xlim' in plot_data:
-            ax.set_xlim(plot_data['xlim'])
-        if 'ylim' in plot_data:
-            ax.set_ylim(plot_data['ylim'])
-        ax.set_xscale(plot_data.get('xscale', 'linear'))
-        ax.set_yscale(plot_data.get('yscale', 'linear'))
+        # The axes properties are set in one call, in the same order as the individual setters
+        ax_kwargs = {key: plot_data[key] for key in ('xlabel', 'ylabel', 'xlim', 'ylim') if key in plot_data}
+        ax_kwargs['xscale'] = plot_data.get('xscale', 'linear')
+        ax_kwargs['yscale'] = plot_data.get('yscale', 'linear')
+        ax.set(**ax_kwargs)
         if plot_data.get('xticks', None):
             ax.set_xticks(plot_data['xticks'],**plot_data.get('xticks_kwargs', {}))
         if plot_data.get('yticks', None):
@@ -236,26 +444,53 @@ def plot_line2D(fig_cfg, plot_cfg, line_cfg):
         if plot_data.get('show_grid', False):
             ax.grid(visible=True, which=plot_data['show_grid'], axis=plot_data.get('grid_axis', 'both'), **plot_data.get('grid_properties', {}))
         handles = {}
+        # The right y-axis is shared by all the lines of the plot that use it
+        ax2 = None
+        batches = {}
         for i, line_id in enumerate(plot_data.get('line', [])):
-            xdata = line_cfg[line_id]['xdata_array']
-            ydata = line_cfg[line_id]['ydata_array']    
-            if line_cfg[line_id].get('rightYAxis', False):
-                ax2 = ax.twinx()
-                ax2.set_ylabel(line_cfg[line_id]['rightYAxis'])
-                if line_cfg[line_id].get('ylim_right', False):
-                    ax2.set_ylim(line_cfg[line_id]['ylim_right'])
-                if line_cfg[line_id].get('rightYAxis_percentage', False):
-                    ax2.yaxis.set_major_formatter(PercentFormatter())
-                handles[line_id],=ax2.plot(xdata, ydata, color=line_cfg[line_id].get('color', 'b'), linestyle=line_cfg[line_id].get('linestyle', '-'),
-                    marker=line_cfg[line_id].get('marker'), markevery=line_cfg[line_id].get('markevery', 1),
-                    label=line_cfg[line_id].get('label'), **line_cfg[line_id].get('line_kwargs', {}))
-            else:
-                handles[line_id],=ax.plot(xdata, ydata, color=line_cfg[line_id].get('color', 'b'), linestyle=line_cfg[line_id].get('linestyle', '-'),
-                    marker=line_cfg[line_id].get('marker'), markevery=line_cfg[line_id].get('markevery', 1),
-                    label=line_cfg[line_id].get('label'), **line_cfg[line_id].get('line_kwargs', {}))
+            spec = specs[line_id]
+            xdata, ydata = spec.xdata_array, spec.ydata_array
+            full_data = None
+            if spec.downsample and spec.marker is None and len(xdata) > n_max_points:
+                full_data = np.asarray(xdata), np.asarray(ydata)
+                xdata, ydata = _downsample(*full_data, n_max_points, plot_data.get('xlim'))
+            line_ax = ax
+            if spec.rightYAxis:
+                if ax2 is None:
+                    ax2 = ax.twinx()
+                    ax2.set_ylabel(spec.rightYAxis)
+                    if spec.ylim_right:
+                        ax2.set_ylim(spec.ylim_right)
+                    if spec.rightYAxis_percentage:
+                        ax2.yaxis.set_major_formatter(PercentFormatter())
+                line_ax = ax2
+            if full_data is not None and len(xdata) < len(full_data[0]):
+                # Autoscaling still covers the whole line when only the points in xlim are plotted
+                line_ax.update_datalim([[np.nanmin(full_data[0]), np.nanmin(full_data[1])],
+                                        [np.nanmax(full_data[0]), np.nanmax(full_data[1])]])
+            if spec.marker is None and not spec.line_kwargs and not fig_cfg.get('animated', False):
+                # Plain lines are drawn together as one LineCollection per axes,
+                # an empty line with the same style stands for the line in the legends
+                batches.setdefault(line_ax, []).append((np.column_stack([xdata, ydata]), spec, line_id))
+                handles[line_id] = line_ax.add_line(Line2D([], [], color=spec.color, linestyle=spec.linestyle, label=spec.label))
+                continue
+            handles[line_id],=line_ax.plot(xdata, ydata, color=spec.color, linestyle=spec.linestyle,
+                marker=spec.marker, markevery=spec.markevery, label=spec.label, **spec.line_kwargs)
+            if fig_cfg.get('animated', False):
+                handles[line_id].set_animated(True)
+        line_handles.update(handles)
+        for line_ax, batch in batches.items():
+            segments, batch_specs, batch_ids = zip(*batch)
+            collection = line_ax.add_collection(LineCollection(segments, colors=[spec.color for spec in batch_specs],
+                linestyles=[spec.linestyle for spec in batch_specs]))
+            for index, line_id in enumerate(batch_ids):
+                line_handles[line_id] = (collection, index)
         [ymin,ymax] =ax.get_ylim() 
         if 'xspan' in plot_data and 'yspan' in plot_data: 
-           ax.fill_between(plot_data['xspan'], ymin, ymax, where=plot_data['yspan'] > 0, **plot_data.get('fill_properties', {}))
+            # The mask is computed once on ndarrays, without creating a pandas Series
+            xspan = np.asarray(plot_data['xspan'])
+            span_mask = np.asarray(plot_data['yspan']) > 0
+            ax.fill_between(xspan, ymin, ymax, where=span_mask, **plot_data.get('fill_properties', {}))
         ax.set_ylim([ymin,ymax])
         # Only show the legend specified in the plot_cfg
         if 'legend' in plot_data:
@@ -271,11 +506,55 @@ def plot_line2D(fig_cfg, plot_cfg, line_cfg):
         fig.legend(lines, labels, **fig_cfg.get('legend_kwargs', {}))
 
     full_path = fig_cfg.get('file_path', './') + fig_cfg.get('filename', 'new_fig') + '.' + fig_cfg.get('fig_format', 'png')
-    plt.savefig(full_path)
+    fig.savefig(full_path)
     if fig_cfg.get('fig_format', 'png') != 'png':
-            full_path_png = fig_cfg.get('file_path', './') + fig_cfg.get('filename', 'new_fig') + '.png'
-            plt.savefig(full_path_png)
-    plt.show()
+        full_path_png = fig_cfg.get('file_path', './') + fig_cfg.get('filename', 'new_fig') + '.png'
+        fig.savefig(full_path_png)
+    if show:
+        plt.show()
+    elif not fig_cfg.get('animated', False):
+        # Release the figure and its renderer when generating figures in batch
+        plt.close(fig)
+    return fig, line_handles
+
+def update_line2D(fig, line_handles, line_data, backgrounds=None):
+    """Update the data of lines plotted with fig_cfg['animated']=True and redraw them by blitting.
+
+    Parameters
+    ----------
+    fig : matplotlib.figure.Figure
+        The figure returned by plot_line2D.
+    line_handles : dict
+        The lines returned by plot_line2D
+        {'line_id': matplotlib.lines.Line2D, ...}
+    line_data : dict
+        The new data of the lines to update
+        {'line_id': (xdata, ydata), ...}
+    backgrounds : dict, default=None
+        The backgrounds returned by the previous call.
+        If None, the figure is drawn without the animated lines and the background of the axes is saved.
+
+    Returns
+    -------
+    backgrounds : dict
+        The saved background of the axes, to be passed to the next call.
+
+    """
+    canvas = fig.canvas
+    if backgrounds is None:
+        canvas.draw()
+        backgrounds = {line.axes: canvas.copy_from_bbox(line.axes.bbox) for line in line_handles.values()}
+    for line_id, (xdata, ydata) in line_data.items():
+        line_handles[line_id].set_data(xdata, ydata)
+    # Restoring the background erases all the animated lines of the axes, so all of them are redrawn
+    for background in backgrounds.values():
+        canvas.restore_region(background)
+    for line in line_handles.values():
+        line.axes.draw_artist(line)
+    for ax in backgrounds:
+        canvas.blit(ax.bbox)
+    canvas.flush_events()
+    return backgrounds
 
 if __name__ == '__main__':
 
@@ -321,4 +600,4 @@ if __name__ == '__main__':
     plot_cfg[2] = {'ylabel': 'i (nA)', 'xlabel': 'Time (ms)','show_grid': 'both', 'grid_axis': 'both',  'ylim': [-500, 400], 'xlim': [0, 80],
                     'line': [5,6,7,8,9], 'legend': [5,6,7,8,9], 'title': '(b) After the addition of sugar','title_y': -0.25}
 
-    plot_line2D(fig_cfg, plot_cfg, line_cfg)
\ No newline at end of file
+    plot_line2D(fig_cfg, plot_cfg, line_cfg, show=True)
\ No newline at end of file
@@ -1,4 +1,24 @@
-import os
+import shutil
+import pandas as pd
+from itertools import islice
+
+def _count_lines(f, limit=None):
+    """Count the lines of a file opened in binary mode and rewind it.
+
+    If limit is given, counting stops as soon as the count exceeds it, so only the start of the file is read.
+    """
+    n_lines = 0
+    last_byte = b'\n'
+    for block in iter(lambda: f.read(1<<20), b''):
+        n_lines += block.count(b'\n')
+        last_byte = block[-1:]
+        if limit is not None and n_lines > limit:
+            break
+    # The last line may not end with a newline
+    if last_byte != b'\n':
+        n_lines += 1
+    f.seek(0)
+    return n_lines
 
 def combine_csv_files(new_csv_file, csv_files):
     """
@@ -9,34 +29,68 @@ def combine_csv_files(new_csv_file, csv_files):
         If the file already exists, it will be overwritten.
     csv_files: list of tuples
         A list of tuples where each tuple contains the name of a csv file and the line numbers that will be copied to the new csv file.
-        The line numbers are 0-based.
+        The line numbers are 0-based, and negative line numbers count from the end of the file, as in list slicing.
+        An end line number of -1 means the last line.
         The tuple includes the filename, start line number, the end line number, and the step size.
         Example:
         [('file1.csv', 0, 10), ('file2.csv', 5, 15, 2)]
+    The lines are copied byte for byte, so their line endings are kept as they are in each file.
     
     """
-    if os.path.exists(new_csv_file):
-        os.remove(new_csv_file)
+    # Stream the selected lines so that the files are never fully loaded in memory
+    with open(new_csv_file, 'wb', buffering=1<<20) as out:
+        for csv_file in csv_files:
+            csv_file_name = csv_file[0]
+            line_start = csv_file[1]
+            if len(csv_file) >= 3 and csv_file[2] != -1:
+                line_stop = csv_file[2] + 1
+            else:
+                line_stop = None
+            if len(csv_file) == 4:
+                line_step = csv_file[3]
+            else:
+                line_step = 1
+            with open(csv_file_name, 'rb', buffering=1<<20) as f:
+                if line_start < 0 or (line_stop is not None and line_stop < 0):
+                    # Negative line numbers count from the end of the file, as in list slicing
+                    line_start, line_stop, _ = slice(line_start, line_stop).indices(_count_lines(f))
+                if line_start == 0 and line_step == 1 and (line_stop is None or line_stop >= _count_lines(f, limit=line_stop)):
+                    # The whole file is copied in blocks without splitting it into lines
+                    shutil.copyfileobj(f, out, length=1<<20)
+                else:
+                    out.writelines(islice(f, line_start, line_stop, line_step))
+
+def combine_csv_files_df(new_csv_file, csv_files):
+    """
+    Combine the rows of multiple csv files with the same columns into a single csv file, using pandas.
+    Parameters:
+    new_csv_file: str
+        The name of the new csv file that will be created.
+        If the file already exists, it will be overwritten.
+    csv_files: list of tuples
+        A list of tuples where each tuple contains the name of a csv file and the line numbers that will be copied to the new csv file.
+        The line numbers are 0-based, as in combine_csv_files, and line 0 is the header.
+        The header is written once and the data lines start at 1, so a start line number of 0 is read as 1.
+        The tuple includes the filename, start line number, the end line number, and the step size.
+        Example:
+        [('file1.csv', 1, 10), ('file2.csv', 5, 15, 2)]
+    
+    """
+    frames = []
     for csv_file in csv_files:
         csv_file_name = csv_file[0]
-        line_start = csv_file[1]
-        if len(csv_file) == 3:
-            line_end = csv_file[2]
+        line_start = max(csv_file[1], 1)
+        if len(csv_file) >= 3 and csv_file[2] != -1:
+            nrows = csv_file[2] - line_start + 1
         else:
-            line_end = -1
+            nrows = None
         if len(csv_file) == 4:
             line_step = csv_file[3]
         else:
             line_step = 1
-        with open(csv_file_name, 'r') as f:
-            lines = f.readlines()
-            with open(new_csv_file, 'a') as file:
-                if len(lines) < line_end or line_end == -1:
-                    line_end = len(lines)-1
-                if line_step>1:
-                    file.writelines(lines[line_start:line_end+1:line_step])
-                else:
-                    file.writelines(lines[line_start:line_end+1])
+        df = pd.read_csv(csv_file_name, skiprows=range(1, line_start), nrows=nrows)
+        frames.append(df.iloc[::line_step])
+    pd.concat(frames).to_csv(new_csv_file, index=False)
                 
 """
 # Example of using pd to get new data by subtracting two columns